@@ -1,106 +1,310 @@
-import csv
+import logging
+import mmap
+import multiprocessing
+import os
 import re
-from datetime import datetime
+import re2
+import sys
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from functools import lru_cache
+from logging.handlers import QueueListener
 from pathlib import Path
-from scripts.common import parse_args, setup_logging, BOT_KEYWORDS, GOOGLEBOT_EXCLUSIONS
+import polars as pl
+import zstandard
+try:
+    from isal import igzip as gzip  # ISA-L inflate, several times faster than zlib
+    from isal import isal_zlib
+except ImportError:
+    import gzip
+    isal_zlib = None
+from scripts.common import (parse_args, setup_logging, setup_worker_logging, LOGGER_NAME,
+                            BOT_KEYWORDS, GOOGLEBOT_EXCLUSIONS)
 
 # Directory containing log files
 LOG_DIR = Path("data/raw")
 # Output directory for processed CSVs
 OUTPUT_DIR = Path("data/processed")
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+# Log files larger than this are split into newline-aligned byte ranges so a
+# single huge file is still spread across worker processes
+CHUNK_SIZE = 64 * 1024 * 1024
+# Gzip logs are decompressed in blocks of this size; a damaged file loses
+# only the block the error is found in and everything after it
+GZIP_BLOCK_SIZE = 1024 * 1024
+# Columns of the aggregated output
+COLUMNS = ["log_file", "user_agent", "requested_resource", "log_line"]
+# Errors raised while decompressing a truncated or corrupt gzip log:
+# gzip.BadGzipFile is an OSError, while invalid deflate data raises the
+# inflate library's own error, which is not
+GZIP_ERRORS = (EOFError, OSError, zlib.error) + ((isal_zlib.error,) if isal_zlib else ())
 
-# Regex to extract all quoted strings (user agent is typically the second-to-last quoted string)
-USER_AGENT_PATTERN = re.compile(r'"([^"]+)"')
+# Month abbreviations as they appear in log timestamps
+MONTHS = {name.encode(): number for number, name in enumerate(
+    ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"], start=1)}
 
-def extract_log_fields(log_line: str, logger, start_date, end_date):
+# Locates the bot keywords in lowercased log data; lines without a match are
+# never parsed. RE2 compiles the alternation to a DFA, which scans whole log
+# chunks several times faster than the backtracking re engine.
+PREFILTER = re2.compile(b"|".join(re.escape(k.lower().encode()) for k in BOT_KEYWORDS))
+
+# Fields of a Kinsta access log line, e.g.
+# host 1.2.3.4 [07/Jul/2025:00:03:40 +0000] GET "/robots.txt" HTTP/1.1 200 "referer" "user agent" ...
+# are located in one forward sweep of bytes.find over the bracketed timestamp
+# and the first six double quotes. The requested resource is the first quoted
+# string and the user agent the third.
+def extract_log_fields(log_line: bytes, logger, start_date, end_date):
     try:
-        # Extract all quoted strings
-        parts = log_line.split('"')
-        # Requested resource is usually in the first quoted string (parts[1])
-        # User agent is usually in the fifth quoted string (parts[5])
-        requested_resource = None
-        user_agent = None
-
-        # Extract timestamp from log line
-        # Example: [07/Jul/2025:00:03:40 +0000]
-        timestamp_match = re.search(r'\[(\d{2}/[A-Za-z]{3}/\d{4}:\d{2}:\d{2}:\d{2}) [+\-]\d{4}\]', log_line)
-        if timestamp_match:
-            timestamp_str = timestamp_match.group(1)
-            # Convert to datetime object
-            log_dt = datetime.strptime(timestamp_str, "%d/%b/%Y:%H:%M:%S")
-            # If start_date or end_date are provided, filter by them
-            if start_date:
-                start_dt = datetime.strptime(start_date, "%Y-%m-%d")
-                if log_dt.date() < start_dt.date():
-                    return "", ""
-            if end_date:
-                end_dt = datetime.strptime(end_date, "%Y-%m-%d")
-                if log_dt.date() > end_dt.date():
-                    return "", ""
-        else: #unparseable record
-            logger.error(f"Could not extract timestamp from log line: {log_line}")
-            return "",""
-        
-        if len(parts) >= 6:
-            # Extract requested resource from the request string (e.g. "/robots.txt")
-            requested_resource = parts[1].strip()
-
-            # Extract the path using regex from the line
-            match = re.search(r'(GET|POST|HEAD|PUT|DELETE|OPTIONS|PATCH)\s+([^\s]+)', log_line)
-            if match:
-                method = match.group(1)
-                if method != "GET":
-                    return "", ""  # Only count GET requests
-            user_agent = parts[5].strip()
-            if user_agent == '-':
-                user_agent = ""
-        else:
-            logger.error(f"Could not extract all fields from log line: {log_line}")
-        return requested_resource or "", user_agent or ""
+        lb = log_line.find(b"[")
+        rb = log_line.find(b"]", lb + 1)
+        q1 = log_line.find(b'"', rb + 1)
+        q2 = log_line.find(b'"', q1 + 1)
+        q3 = log_line.find(b'"', q2 + 1)
+        q4 = log_line.find(b'"', q3 + 1)
+        q5 = log_line.find(b'"', q4 + 1)
+        q6 = log_line.find(b'"', q5 + 1)
+        if min(lb, rb, q1, q2, q3, q4, q5, q6) < 0:  # unparseable record
+            logger.error(f"Could not extract all fields from log line: {log_line!r}")
+            return "", ""
+
+        # If start_date or end_date (date objects) are provided, filter by them.
+        # Only the DD/Mon/YYYY part of the timestamp (e.g. 07/Jul/2025:00:03:40)
+        # is needed for that, so it is sliced out rather than parsed with strptime.
+        if start_date or end_date:
+            ts = log_line[lb + 1:rb]
+            log_date = date(int(ts[7:11]), MONTHS[ts[3:6]], int(ts[0:2]))
+            if start_date and log_date < start_date:
+                return "", ""
+            if end_date and log_date > end_date:
+                return "", ""
+
+        # The method sits between the timestamp and the quoted resource
+        method = log_line[rb + 1:q1].strip()
+        if method and method != b"GET":
+            return "", ""  # Only count GET requests
+
+        requested_resource = log_line[q1 + 1:q2].decode("utf-8", errors="ignore").strip()
+        user_agent = log_line[q5 + 1:q6].decode("utf-8", errors="ignore").strip()
+        if user_agent == '-':
+            user_agent = ""
+        return requested_resource, user_agent
     except Exception as e:
-        logger.error(f"Error extracting fields from log line: {log_line} ({e})")
+        logger.error(f"Error extracting fields from log line: {log_line!r} ({e})")
         return "", ""
 
-def is_ai_bot(user_agent: str) -> bool:
-    ua = user_agent.lower()
-    if "googlebot" in ua:
-        if any(excl in ua for excl in GOOGLEBOT_EXCLUSIONS):
-            return False
-        return True
-    return any(bot in ua for bot in BOT_KEYWORDS)
+# is_ai_bot is generated once from BOT_KEYWORDS and GOOGLEBOT_EXCLUSIONS as a
+# chain of literal `in` tests, so each call runs straight-line short-circuiting
+# bytecode instead of looping over the keyword lists. Googlebot is tested first.
+def _build_is_ai_bot():
+    exclusions = " or ".join(f"{keyword!r} in ua" for keyword in GOOGLEBOT_EXCLUSIONS) or "False"
+    bots = " or ".join(f"{keyword!r} in ua" for keyword in BOT_KEYWORDS if keyword != "googlebot") or "False"
+    source = (
+        "def is_ai_bot(user_agent: str) -> bool:\n"
+        "    ua = user_agent.lower()\n"
+        "    if 'googlebot' in ua:\n"
+        f"        return not ({exclusions})\n"
+        f"    return {bots}\n"
+    )
+    namespace = {}
+    exec(source, namespace)
+    return namespace["is_ai_bot"]
+
+# A log has only a handful of distinct user agents, so results are memoized
+is_ai_bot = lru_cache(maxsize=8192)(_build_is_ai_bot())
+
+# Split a log file into (lo, hi) byte ranges of roughly chunk_size bytes,
+# each ending just after a newline. Gzip-compressed files cannot be split and
+# are always a single range.
+def split_log_file(log_file, chunk_size=CHUNK_SIZE):
+    size = log_file.stat().st_size
+    if size <= chunk_size or log_file.suffix == ".gz":
+        return [(0, size)] if size else []
+    ranges = []
+    with open(log_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        lo = 0
+        while lo < size:
+            hi = lo + chunk_size
+            if hi >= size:
+                hi = size
+            else:
+                newline = mm.find(b"\n", hi - 1)
+                hi = size if newline < 0 else newline + 1
+            ranges.append((lo, hi))
+            lo = hi
+    return ranges
+
+# Yield only the lines in data[lo:hi] (bytes or a memory map) that contain a
+# bot keyword. The range is lowercased in one bulk copy and PREFILTER is
+# searched over it directly, so the regex engine skips non-bot lines in C
+# rather than Python iterating over every line.
+def scan_buffer(data, lo=0, hi=None):
+    lowered = data[lo:hi].lower()
+    size = len(lowered)
+    pos = 0
+    while True:
+        match = PREFILTER.search(lowered, pos)
+        if not match:
+            break
+        line_start = lowered.rfind(b"\n", 0, match.start()) + 1
+        line_end = lowered.find(b"\n", match.end())
+        if line_end < 0:
+            line_end = size  # last line without a trailing newline
+        yield data[lo + line_start:lo + line_end]
+        pos = line_end + 1
+
+# Yield the bot keyword lines in [lo, hi) of a plain log file via a read-only
+# memory map
+def scan_log_chunk(log_file, lo=0, hi=None):
+    with open(log_file, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return  # empty files cannot be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):  # not available on Windows
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            yield from scan_buffer(mm, lo, hi)
+
+# Yield the bot keyword lines of a gzip-compressed log file, decompressing it
+# on the fly in blocks of about block_size bytes cut at the last newline. A
+# truncated or corrupt file keeps the lines of the blocks read before the
+# damage. A CRC mismatch is only detected at the end of the file, so at most
+# its last block is lost then.
+def scan_gzip_log(log_file, block_size=GZIP_BLOCK_SIZE):
+    with gzip.open(log_file, "rb") as f:
+        remainder = b""
+        while True:
+            try:
+                block = f.read(block_size)
+            except GZIP_ERRORS as e:
+                logging.getLogger(LOGGER_NAME).error(f"Error reading {log_file.name}, skipping the rest of it: {e}")
+                return  # the remainder is an incomplete line
+            if not block:
+                break
+            block = remainder + block
+            cut = block.rfind(b"\n") + 1
+            remainder = block[cut:]
+            yield from scan_buffer(block, 0, cut)
+        if remainder:
+            yield from scan_buffer(remainder)
+
+# Collect the AI bot records from the [lo, hi) byte range of log_file as a
+# columnar frame, one list per column rather than one list per record
+def collect_chunk_records(log_file, lo, hi, start_date, end_date):
+    logger = logging.getLogger(LOGGER_NAME)
+    user_agents = []
+    requested_resources = []
+    log_lines = []
+    # Reuse one string object per distinct user agent / resource; repeats are
+    # then stored once and hash-cached for the is_ai_bot lookup
+    ua_pool = {}
+    resource_pool = {}
+    if log_file.suffix == ".gz":
+        lines = scan_gzip_log(log_file)
+    else:
+        lines = scan_log_chunk(log_file, lo, hi)
+    # Lines stay raw bytes; only the matching bot records are decoded
+    for line in lines:
+        requested_resource, user_agent = extract_log_fields(line, logger, start_date, end_date)
+        if not user_agent:
+            continue
+        user_agent = ua_pool.setdefault(user_agent, user_agent)
+        requested_resource = resource_pool.setdefault(requested_resource, requested_resource)
+        if is_ai_bot(user_agent):
+            user_agents.append(user_agent)
+            requested_resources.append(requested_resource)
+            log_lines.append(line.strip().decode("utf-8", errors="ignore"))
+    return pl.DataFrame(
+        [[log_file.name] * len(user_agents), user_agents, requested_resources, log_lines],
+        schema=dict.fromkeys(COLUMNS, pl.String),
+        orient="col",
+    )
+
+# Worker: process one (log_file, lo, hi) chunk. A failure is logged with the
+# chunk it happened in and reported to the driver as None.
+def _process_chunk(chunk, start_date, end_date):
+    log_file, lo, hi = chunk
+    try:
+        return collect_chunk_records(log_file, lo, hi, start_date, end_date)
+    except Exception as e:
+        logging.getLogger(LOGGER_NAME).error(f"Error processing {log_file.name} bytes {lo}-{hi}: {e}")
+        return None
+
+# Like executor.map, but with at most `window` chunks submitted and not yet
+# consumed, so finished frames queued behind a slow earlier chunk cannot pile
+# up in this process. Results are yielded in chunk order.
+def _map_chunks(executor, chunks, window, *args):
+    pending = deque()
+    for chunk in chunks:
+        pending.append(executor.submit(_process_chunk, chunk, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
 
 def process_logs(start_date=None, end_date=None):
     logger = setup_logging('aggregate.log')
     logger.info(f"Starting log aggregation and filtering process (start_date={start_date}, end_date={end_date})")
+    # Parse the date range once rather than on every log line
+    start_dt = date.fromisoformat(start_date) if start_date else None
+    end_dt = date.fromisoformat(end_date) if end_date else None
 
-    bot_records = []
+    chunks = []
     for log_file in LOG_DIR.glob("access.log*"):
         logger.info(f"Processing access log file: {log_file}")
+        for lo, hi in split_log_file(log_file):
+            chunks.append((log_file, lo, hi))
 
-        with open(log_file, "r", encoding="utf-8", errors="ignore") as f:
-            for line in f:
-                requested_resource, user_agent = extract_log_fields(line, logger, start_date, end_date)
-                if not user_agent:
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_file = OUTPUT_DIR / f"ai_bot_traffic_{timestamp}.csv.zst"
+    record_count = 0
+    failed_chunks = 0
+    # Workers send their log records through a queue; only this process
+    # writes them to the log file and console
+    log_queue = multiprocessing.Queue()
+    listener = QueueListener(log_queue, *logger.handlers, respect_handler_level=True)
+    listener.start()
+    try:
+        # Parse the chunks in parallel, at most two per worker in flight, and
+        # stream each chunk's records to the CSV in file order as soon as it
+        # is done. The CSV is zstd-compressed as it is written.
+        max_workers = os.cpu_count() or 1
+        with open(output_file, "wb") as raw_file, \
+                zstandard.ZstdCompressor(level=3).stream_writer(raw_file) as csvfile, \
+                ProcessPoolExecutor(max_workers=max_workers, initializer=setup_worker_logging,
+                                    initargs=(log_queue,)) as executor:
+            results = _map_chunks(executor, chunks, 2 * max_workers, start_dt, end_dt)
+            header_written = False
+            for records in results:
+                if records is None:
+                    failed_chunks += 1
                     continue
-                if is_ai_bot(user_agent):
-                    bot_records.append([log_file.name, user_agent, requested_resource, line.strip()])
-
-    if bot_records:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        try:
-            output_file = OUTPUT_DIR / f"ai_bot_traffic_{timestamp}.csv"
-            with open(output_file, "w", newline="", encoding="utf-8") as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(["log_file", "user_agent", "requested_resource", "log_line"])
-                writer.writerows(bot_records)
-            logger.info(f"{len(bot_records)} AI bot traffic records saved to {output_file}")
-            print(output_file)  
-        except Exception as e:
-            logger.error(f"Error saving bot traffic records to CSV: {e}")
-    else:
-        logger.info("No AI bot traffic records found.")
+                records.write_csv(csvfile, include_header=not header_written)
+                header_written = True
+                record_count += records.height
+    except Exception as e:
+        logger.error(f"Error saving bot traffic records to CSV: {e}")
+        output_file.unlink(missing_ok=True)
+        raise
+    finally:
+        listener.stop()
+
+    if failed_chunks:
+        logger.error(f"{failed_chunks} of {len(chunks)} log chunks failed to process; discarding {output_file}")
+        output_file.unlink()
+        raise RuntimeError(f"{failed_chunks} of {len(chunks)} log chunks failed to process")
+
+    if record_count:
+        logger.info(f"{record_count} AI bot traffic records saved to {output_file}")
+        return output_file
+    output_file.unlink()
+    logger.info("No AI bot traffic records found.")
+    return None
 
 if __name__ == "__main__":
     args = parse_args("Aggregate AI bot traffic logs.")
-    process_logs(start_date=args.start_date, end_date=args.end_date)
\ No newline at end of file
+    try:
+        process_logs(start_date=args.start_date, end_date=args.end_date)
+    except Exception as e:
+        print(f"Aggregation failed: {e}")
+        sys.exit(1)
\ No newline at end of file
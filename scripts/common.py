@@ -1,5 +1,6 @@
 import sys
 import logging
+from logging.handlers import QueueHandler
 from pathlib import Path
 import argparse
 
@@ -26,8 +27,16 @@ GOOGLEBOT_EXCLUSIONS = [
 project_root = Path(__file__).parent
 sys.path.append(str(project_root))
 
+LOGGER_NAME = "ai_seo_analysis"
+# Log file the handlers are currently set up for
+_configured_log_filename = None
+
 def setup_logging(log_filename: str = 'download.log'):
-    logger = logging.getLogger("ai_seo_analysis")
+    global _configured_log_filename
+    logger = logging.getLogger(LOGGER_NAME)
+    # Handlers are only rebuilt when switching to a different log file
+    if _configured_log_filename == log_filename:
+        return logger
     logger.setLevel(logging.DEBUG)
 
     # Ensure data directory exists before creating log file
@@ -55,4 +64,14 @@ def setup_logging(log_filename: str = 'download.log'):
     ch.setFormatter(formatter)
     logger.addHandler(ch)
 
+    _configured_log_filename = log_filename
+    return logger
+
+def setup_worker_logging(queue):
+    # Worker processes only forward records to the parent through the queue;
+    # a QueueListener there writes them with its own handlers
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(logging.DEBUG)
+    logger.handlers.clear()
+    logger.addHandler(QueueHandler(queue))
     return logger
\ No newline at end of file
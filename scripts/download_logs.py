@@ -5,11 +5,14 @@ Downloads rotated web server access logs from remote hosting provider via SFTP.
 Handles multiple log files with date patterns and tracks downloaded files to avoid duplicates.
 """
 
+import os
 import sys
 import paramiko
 import logging
 import json
 import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime, date
 from scripts.common import setup_logging
@@ -22,6 +25,11 @@ except ImportError:
     print("Please create config/credentials.py based on credentials.py.example")
     sys.exit(1)
 
+# Number of files downloaded concurrently, each over its own SFTP channel
+MAX_PARALLEL_DOWNLOADS = 8
+# Buffer size used when copying a remote file to disk
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
 def ensure_data_directory():
     """Ensure the data/raw directory exists."""
     raw_data_dir = Path('data/raw')
@@ -91,15 +99,19 @@ def list_remote_log_files(sftp_client, remote_directory, logger):
         return []
 
 def get_existing_raw_files():
-    raw_data_dir = Path('data/raw')
-    return set(f.name for f in raw_data_dir.glob("access.log*") if f.is_file())
+    # One scandir pass; DirEntry.is_file() uses the file type from the directory
+    # listing instead of a separate stat call per file
+    with os.scandir(Path('data/raw')) as entries:
+        return {entry.name for entry in entries
+                if entry.name.startswith("access.log") and entry.is_file()}
 
 def filter_files_to_download(log_files, logger):
     """
     Filter log files to only include those that:
     1. Have dates before today
     2. Aren't already present in data/raw
-    3. Are actual log files (not directories, compressed files, etc.)
+    3. Are actual log files (not directories, archives, etc.); gzip-compressed
+       logs are kept and read directly by the aggregation step
     
     Args:
         log_files (list): List of tuples (filename, date)
@@ -109,7 +121,8 @@ def filter_files_to_download(log_files, logger):
         list: Filtered list of (filename, date) tuples to download
     """
     today = date.today()
-    existing_files = get_existing_raw_files()
+    # Compare names without .gz so a log is not fetched again once compressed
+    existing_files = {name.removesuffix('.gz') for name in get_existing_raw_files()}
     to_download = []
     
     for filename, file_date in log_files:
@@ -125,10 +138,12 @@ def filter_files_to_download(log_files, logger):
             logger.debug(f"Skipping {filename}: date {file_date} is not before today")
             continue
         
-        # Skip if already downloaded
-        if filename in existing_files:
+        # Skip if already downloaded (compressed or not)
+        log_name = filename.removesuffix('.gz')
+        if log_name in existing_files:
             logger.debug(f"Skipping {filename}: already exists in raw folder")
             continue
+        existing_files.add(log_name)
         
         logger.debug(f"FILTER: Adding {filename} to download list")
         to_download.append((filename, file_date))
@@ -150,8 +165,9 @@ def is_valid_log_file(filename):
     # Convert to lowercase for case-insensitive checks
     filename_lower = filename.lower()
     
-    # Skip compressed files
-    compressed_extensions = ['.gz', '.zip', '.bz2', '.xz', '.7z', '.tar']
+    # Skip compressed files other than gzip, which the aggregation step
+    # decompresses on the fly
+    compressed_extensions = ['.zip', '.bz2', '.xz', '.7z', '.tar']
     if any(filename_lower.endswith(ext) for ext in compressed_extensions):
         return False
 
@@ -171,6 +187,9 @@ def download_log_file(sftp_client, remote_directory, filename, local_dir, logger
     Returns:
         bool: True if download successful, False otherwise
     """
+    # Write to a hidden temporary name first so an interrupted transfer never
+    # leaves a partial access.log* file that later runs treat as downloaded
+    temp_path = local_dir / f".{filename}.part"
     try:
         remote_path = f"{remote_directory.rstrip('/')}/{filename}"
         local_path = local_dir / filename  # Keep original filename
@@ -186,8 +205,12 @@ def download_log_file(sftp_client, remote_directory, filename, local_dir, logger
             logger.error(f"Remote file not found: {remote_path}")
             return False
         
-        # Download the file
-        sftp_client.get(remote_path, str(local_path))
+        # Download the file; prefetch keeps many READ requests in flight
+        # instead of waiting for each block in turn
+        with sftp_client.open(remote_path, 'rb') as remote_file, open(temp_path, 'wb') as local_file:
+            remote_file.prefetch(file_stats.st_size)
+            shutil.copyfileobj(remote_file, local_file, DOWNLOAD_CHUNK_SIZE)
+        os.replace(temp_path, local_path)
         
         # Verify download
         if local_path.exists():
@@ -200,9 +223,42 @@ def download_log_file(sftp_client, remote_directory, filename, local_dir, logger
             
     except Exception as e:
         logger.error(f"✗ Error downloading {filename}: {str(e)}")
+        temp_path.unlink(missing_ok=True)
         return False
 
 
+def download_log_files(transport, remote_directory, filenames, local_dir, logger):
+    """
+    Download a batch of log files over a dedicated SFTP channel.
+    
+    Args:
+        transport: SSH transport shared by all download channels
+        remote_directory (str): Remote directory path
+        filenames (list): Names of the files to download
+        local_dir (Path): Local directory to save the files
+        logger: Logger instance
+    
+    Returns:
+        list: Tuples (filename, success) in download order, or None if no
+            SFTP channel could be opened (e.g. the server's MaxSessions limit)
+    """
+    try:
+        sftp_client = paramiko.SFTPClient.from_transport(transport)
+    except paramiko.SSHException as e:  # includes ChannelException
+        logger.warning(f"Could not open an SFTP channel for {len(filenames)} file(s): {str(e)}")
+        return None
+    if sftp_client is None:
+        logger.warning(f"Could not open an SFTP channel for {len(filenames)} file(s)")
+        return None
+    try:
+        return [
+            (filename, download_log_file(sftp_client, remote_directory, filename, local_dir, logger))
+            for filename in filenames
+        ]
+    finally:
+        sftp_client.close()
+
+
 def connect_sftp(config, logger):
     """
     Establish SFTP connection to the remote server.
@@ -284,12 +340,29 @@ def main():
             logger.info("No new files to download")
             return True
         
-        # Download each file
-        for filename, file_date in files_to_download:
-            success = download_log_file(
-                sftp_client, remote_log_directory, filename, local_dir, logger
-            )
-            
+        # Download the files in parallel: split them across worker threads,
+        # each opening its own SFTP channel on the existing SSH transport
+        filenames = [filename for filename, file_date in files_to_download]
+        workers = min(MAX_PARALLEL_DOWNLOADS, len(filenames))
+        batches = [filenames[i::workers] for i in range(workers)]
+        transport = ssh_client.get_transport()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            batch_results = list(executor.map(
+                lambda batch: download_log_files(transport, remote_log_directory, batch, local_dir, logger),
+                batches
+            ))
+        results = []
+        for batch, batch_result in zip(batches, batch_results):
+            if batch_result is None:
+                # No extra channel was available; fall back to the main SFTP session
+                logger.info(f"Downloading {len(batch)} file(s) over the main SFTP session")
+                batch_result = [
+                    (filename, download_log_file(sftp_client, remote_log_directory, filename, local_dir, logger))
+                    for filename in batch
+                ]
+            results.extend(batch_result)
+        
+        for filename, success in results:
             if success:
                 downloaded_files.append(filename)
                 new_downloads.add(filename)
@@ -1,64 +1,94 @@
-import csv
-import subprocess
+import re
+import sys
 from pathlib import Path
-from collections import Counter, defaultdict
+import polars as pl
+import zstandard
 from scripts.common import parse_args, BOT_KEYWORDS
+from scripts.aggregate_bot_traffic import process_logs
+from scripts.qualitative_analysis import llm_configured, get_llm_insights
 
-def run_aggregation(start_date=None, end_date=None):
-    cmd = "python -m scripts.aggregate_bot_traffic"
-    if start_date:
-        cmd += " --start-date " + start_date
-    if end_date:
-        cmd += " --end-date " + end_date
-    result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-    output_file = result.stdout.strip().splitlines()[-1]  # Get the last line
-    return output_file
+# One alternation over all bot keywords, so a user agent is classified with a
+# single regex scan rather than one substring test per keyword
+BOT_PATTERN = "(" + "|".join(re.escape(keyword) for keyword in BOT_KEYWORDS) + ")"
 
-def analyze_bot_hits(csv_file):
-    all_hits = 0
-    resource_counter = Counter()
-    bot_total_hits = Counter()
-    bot_resource_counter = defaultdict(Counter)
+def read_aggregated_csv(csv_file, columns):
+    # Aggregated CSVs are zstd-compressed (.csv.zst); plain .csv files from
+    # older runs are read as-is. All strings, no type inference.
+    if Path(csv_file).suffix == ".zst":
+        with open(csv_file, "rb") as f:
+            return pl.read_csv(zstandard.ZstdDecompressor().stream_reader(f),
+                               columns=columns, infer_schema=False).lazy()
+    return pl.scan_csv(csv_file, infer_schema=False).select(columns)
 
-    with open(csv_file, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            resource = row.get("requested_resource", "").strip()
-            if (resource != "/"):
-                resource = resource.strip("/")  # Normalize resource path
-            user_agent = row.get("user_agent", "").lower()
-            if not resource or not user_agent:
-                continue
+def analyze_bot_hits(csv_file):
+    # Columnar pass over the aggregated CSV
+    hits = (
+        read_aggregated_csv(csv_file, ["requested_resource", "user_agent"])
+        .select(
+            pl.col("requested_resource").fill_null("").str.strip_chars().alias("resource"),
+            pl.col("user_agent").fill_null("").str.to_lowercase(),
+        )
+        .with_columns(
+            # Normalize resource path
+            pl.when(pl.col("resource") == "/")
+            .then(pl.col("resource"))
+            .otherwise(pl.col("resource").str.strip_chars("/"))
+            .alias("resource")
+        )
+        .filter((pl.col("resource") != "") & (pl.col("user_agent") != ""))
+    )
 
-            # Identify bot type from user agent using BOT_KEYWORDS
-            bot = "other"
-            for keyword in BOT_KEYWORDS:
-                if keyword in user_agent:
-                    bot = keyword
-                    break
+    # Identify bot type from user agent using BOT_KEYWORDS. The keyword that
+    # appears earliest in the user agent wins, not BOT_KEYWORDS order. Only a
+    # handful of distinct user agents make up all the rows, so each is
+    # classified once and joined back in row order.
+    bots = hits.select("user_agent").unique().with_columns(
+        pl.col("user_agent").str.extract(BOT_PATTERN, 1).fill_null("other").alias("bot")
+    )
+    hits = hits.join(bots, on="user_agent", how="left", maintain_order="left")
 
-            resource_counter[resource] += 1
-            bot_resource_counter[bot][resource] += 1
-            bot_total_hits[bot] += 1
-            all_hits += 1
+    # Group in first-seen order and sort stably, so ties rank like Counter.most_common
+    resource_counter, bot_resource_counter, bot_total_hits = pl.collect_all([
+        hits.group_by("resource", maintain_order=True).len()
+            .sort("len", descending=True, maintain_order=True),
+        hits.group_by("bot", "resource", maintain_order=True).len()
+            .sort("len", descending=True, maintain_order=True),
+        hits.group_by("bot", maintain_order=True).len(),
+    ])
+    all_hits = bot_total_hits["len"].sum()
 
     return resource_counter, bot_resource_counter, bot_total_hits, all_hits
 
 def print_analysis(resource_counter, bot_resource_counter, bot_total_hits, all_hits):
     print(f"=== Overall Resource Hit Counts (All AI Bots, {all_hits} Total Hits) ===")
-    for resource, count in resource_counter.most_common():
+    for resource, count in resource_counter.iter_rows():
         print(f"{resource}: {count}")
 
     print("\n=== Resource Hit Counts by Bot ===")
-    for bot, counter in bot_resource_counter.items():
-        print(f"\nBot: {bot} (Hits = {bot_total_hits[bot]})")
-        for resource, count in counter.most_common():
+    for bot, total in bot_total_hits.iter_rows():
+        print(f"\nBot: {bot} (Hits = {total})")
+        counter = bot_resource_counter.filter(pl.col("bot") == bot).select("resource", "len")
+        for resource, count in counter.iter_rows():
             print(f"  {resource}: {count}")
 
 if __name__ == "__main__":
     args = parse_args("Hit count analysis.")
-    output_file = run_aggregation(start_date=args.start_date, end_date=args.end_date)
+    try:
+        output_file = process_logs(start_date=args.start_date, end_date=args.end_date)
+    except Exception as e:
+        print(f"Aggregation failed: {e}")
+        sys.exit(1)
+    if not output_file:
+        print("No AI bot traffic records to analyze.")
+        sys.exit(0)
     print(f"Analyzing file: {output_file}")
 
-    resource_counter, bot_resource_counter, bot_total_hits, all_hits = analyze_bot_hits(Path(output_file))
-    print_analysis(resource_counter, bot_resource_counter, bot_total_hits, all_hits)
\ No newline at end of file
+    resource_counter, bot_resource_counter, bot_total_hits, all_hits = analyze_bot_hits(output_file)
+    print_analysis(resource_counter, bot_resource_counter, bot_total_hits, all_hits)
+
+    # If LLM config is present, get insights on the hit counts just computed
+    if llm_configured():
+        try:
+            get_llm_insights(resource_counter, bot_resource_counter)
+        except Exception as e:
+            print(f"Error getting LLM insights: {e}")
\ No newline at end of file
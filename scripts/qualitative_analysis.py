@@ -1,18 +1,9 @@
-import csv
-import subprocess
+import sys
 from pathlib import Path
 import importlib.util
-from scripts.common import parse_args, BOT_KEYWORDS
-
-def run_aggregation(start_date=None, end_date=None):
-    cmd = "python -m scripts.aggregate_bot_traffic"
-    if start_date:
-        cmd += " --start-date " + start_date
-    if end_date:
-        cmd += " --end-date " + end_date
-    result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-    output_file = result.stdout.strip().splitlines()[-1]  # Get the last line
-    return output_file
+import polars as pl
+from scripts.common import parse_args
+from scripts.aggregate_bot_traffic import process_logs
 
 # Try to import config
 config = None
@@ -22,16 +13,36 @@ if config_path.exists():
     config = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(config)
 
-def get_llm_insights(csv_file):
-    import openai
+def llm_configured():
+    return bool(config and getattr(config, "LLM_API_KEY", None))
+
+def markdown_table(rows):
+    lines = ["| Resource | Hits |", "| --- | --- |"]
+    for resource, count in rows:
+        resource = resource.replace("|", "\\|")
+        lines.append(f"| {resource} | {count} |")
+    return "\n".join(lines)
 
-    # Read the CSV content as context
-    with open(csv_file, "r", encoding="utf-8") as f:
-        csv_content = f.read()
+def format_hit_summary(resource_counter, bot_resource_counter, top_resources=50, top_per_bot=20):
+    # Markdown tables of the top resources overall and per bot, from the frames
+    # returned by hit_count_analysis.analyze_bot_hits
+    sections = [f"## All AI bots (top {top_resources} resources)\n\n"
+                + markdown_table(resource_counter.head(top_resources).iter_rows())]
+    for bot in bot_resource_counter["bot"].unique(maintain_order=True):
+        counter = bot_resource_counter.filter(pl.col("bot") == bot).select("resource", "len")
+        sections.append(f"## {bot} (top {top_per_bot} resources)\n\n"
+                        + markdown_table(counter.head(top_per_bot).iter_rows()))
+    return "\n\n".join(sections)
+
+def get_llm_insights(resource_counter, bot_resource_counter):
+    import openai
 
+    # Send the aggregated hit counts rather than every bot record, so the
+    # prompt stays small no matter how much traffic was logged
     prompt = (
-        "Please describe the insights you glean from this listing of all the AI bot traffic that hit our site:\n\n"
-        + csv_content
+        "Please describe the insights you glean from this summary of the AI bot traffic that hit our site "
+        "(hit counts per requested resource, overall and per bot):\n\n"
+        + format_hit_summary(resource_counter, bot_resource_counter)
     )
 
     openai.api_key = getattr(config, "LLM_API_KEY", None)
@@ -51,13 +62,22 @@ def get_llm_insights(csv_file):
 
 if __name__ == "__main__":
     args = parse_args("Qualitative analysis.")
-    output_file = run_aggregation(start_date=args.start_date, end_date=args.end_date)
+    try:
+        output_file = process_logs(start_date=args.start_date, end_date=args.end_date)
+    except Exception as e:
+        print(f"Aggregation failed: {e}")
+        sys.exit(1)
+    if not output_file:
+        print("No AI bot traffic records to analyze.")
+        sys.exit(0)
     print(f"Qualitative analysis of file: {output_file}")
 
     # If LLM config is present, get insights
-    if config and hasattr(config, "LLM_API_KEY") and getattr(config, "LLM_API_KEY"):
+    if llm_configured():
+        from scripts.hit_count_analysis import analyze_bot_hits
         try:
-            get_llm_insights(output_file)
+            resource_counter, bot_resource_counter, _, _ = analyze_bot_hits(output_file)
+            get_llm_insights(resource_counter, bot_resource_counter)
         except Exception as e:
             print(f"Error getting LLM insights: {e}")
     else: